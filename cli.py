@@ -2,9 +2,14 @@ from __future__ import annotations
 
 import argparse
 import ipaddress
+import os
+import shlex
 from typing import Any
 
 from settings import Settings
+from stream import Stream
+from template import tunnel_id_max
+from tuning import nic_numa_node, numa_node_cpus
 
 
 class CliArgs:
@@ -30,6 +35,30 @@ class CliArgs:
             required=False,
             default=Settings.MAX_DURATION,
         )
+        parser.add_argument(
+            "-c",
+            help="Number of packets to transmit, instead of transmitting "
+            "for -d seconds.",
+            type=int,
+            required=False,
+            default=None,
+        )
+        parser.add_argument(
+            "--per-intf",
+            help="Transmit -c packets per interface instead of in total.",
+            action="store_true",
+            required=False,
+            default=False,
+        )
+        parser.add_argument(
+            "--cycles",
+            help="Number of times to cycle through all flows, instead of "
+            "transmitting for -d seconds. A cycle ends when all the rotated "
+            "values are back at their initial values.",
+            type=int,
+            required=False,
+            default=None,
+        )
         parser.add_argument(
             "-g",
             help="Inter-packet gap in seconds. Must be >= 0.0 and <= 60.0. "
@@ -62,6 +91,116 @@ class CliArgs:
             default=Settings.PRINT_PACKET,
         )
 
+        parser.add_argument(
+            "--stream",
+            help="Add a stream of packets with its own header stack, given "
+            "as a quoted string of the Stream, Ethernet, VLAN, MPLS, L3, L4 "
+            "and Tunnel Settings below. This can be specified multiple "
+            "times to send multiple streams at once. Settings given outside of "
+            "--stream are inherited by all streams, and replaced by the "
+            "settings given in a stream, e.g. -m in a stream replaces any "
+            "number of -m given outside of --stream. Options which take no "
+            "value, such as -6 or --l4-src, can't be turned off for a single "
+            "stream once given outside of --stream. If --stream isn't used, "
+            "one stream is sent using the settings given outside of "
+            "--stream.",
+            type=str,
+            required=False,
+            action='append',
+            default=None,
+        )
+
+        CliArgs.add_stream_args(parser)
+
+        tx_args = parser.add_argument_group("Tx Tuning Settings")
+        tx_args.add_argument(
+            "--cpu",
+            help="Pin the tx thread to this CPU. This can be specified "
+            "multiple times to allow the tx thread to run on a set of CPUs.",
+            type=int,
+            required=False,
+            action='append',
+            default=Settings.TX_CPUS,
+        )
+        tx_args.add_argument(
+            "--numa-node",
+            help="Pin the tx thread to the CPUs of this NUMA node.",
+            type=int,
+            required=False,
+            default=Settings.TX_NUMA_NODE,
+        )
+        tx_args.add_argument(
+            "--numa-nic",
+            help="Pin the tx thread to the CPUs of the NUMA node which the "
+            "first -i interface is attached to.",
+            default=False,
+            action="store_true",
+            required=False,
+        )
+        tx_args.add_argument(
+            "--sched-fifo",
+            help="Run the tx thread with the SCHED_FIFO scheduling policy at "
+            "this priority (1-99), when permitted.",
+            type=int,
+            required=False,
+            default=Settings.TX_SCHED_FIFO,
+        )
+        tx_args.add_argument(
+            "--sndbuf",
+            help="Set SO_SNDBUF in bytes on the tx sockets.",
+            type=int,
+            required=False,
+            default=Settings.SOCKET_SNDBUF,
+        )
+        tx_args.add_argument(
+            "--so-priority",
+            help="Set SO_PRIORITY on the tx sockets.",
+            type=int,
+            required=False,
+            default=Settings.SOCKET_PRIORITY,
+        )
+        tx_args.add_argument(
+            "--busy-poll",
+            help="Set SO_BUSY_POLL in microseconds on the tx sockets.",
+            type=int,
+            required=False,
+            default=Settings.SOCKET_BUSY_POLL,
+        )
+        tx_args.add_argument(
+            "--qdisc-bypass",
+            help="Set PACKET_QDISC_BYPASS on the tx sockets, sending frames "
+            "directly to the NIC driver instead of via the qdisc.",
+            default=Settings.SOCKET_QDISC_BYPASS,
+            action="store_true",
+            required=False,
+        )
+
+        return parser
+
+    @staticmethod
+    def add_stream_args(parser: argparse.ArgumentParser) -> None:
+        """
+        Add the CLI options which are set per stream
+        """
+        stream_args = parser.add_argument_group("Stream Settings")
+        stream_args.add_argument(
+            "--share",
+            help="The share of the packet rate for this stream, relative to "
+            "the share of the other streams.",
+            default=Stream.SHARE,
+            type=int,
+            required=False,
+        )
+        stream_args.add_argument(
+            "--replay",
+            help="Replay the frames of a pcap file in a loop, instead of "
+            "building packets. Only the options which change values per "
+            "packet apply, they rewrite the inner most headers of each frame.",
+            default=Stream.REPLAY,
+            type=str,
+            required=False,
+        )
+
         eth_args = parser.add_argument_group("Ethernet Settings")
         eth_args.add_argument(
             "--l2-dst",
@@ -89,14 +228,14 @@ class CliArgs:
         eth_args.add_argument(
             "--dst-mac",
             help=f"Set the initial destination MAC.",
-            default=Settings.ETHERNET_DST,
+            default=Stream.ETHERNET_DST,
             type=str,
             required=False,
         )
         eth_args.add_argument(
             "--src-mac",
             help=f"Set the initial source MAC.",
-            default=Settings.ETHERNET_SRC,
+            default=Stream.ETHERNET_SRC,
             type=str,
             required=False,
         )
@@ -135,6 +274,23 @@ class CliArgs:
             action="store_true",
             required=False,
         )
+        mpls_args.add_argument(
+            "--entropy-label",
+            help="Insert an Entropy Label Indicator and an Entropy Label "
+            "after the outer most MPLS label. The Entropy Label is derived "
+            "from a hash of the inner flow. Requires -m.",
+            default=False,
+            action="store_true",
+            required=False,
+        )
+        mpls_args.add_argument(
+            "--entropy-label-rotate",
+            help="Change the Entropy Label per-frame, instead of deriving it "
+            "from the inner flow.",
+            default=False,
+            action="store_true",
+            required=False,
+        )
 
         ip_args = parser.add_argument_group("L3 Settings")
         ip_args.add_argument(
@@ -161,28 +317,28 @@ class CliArgs:
         ip_args.add_argument(
             "--dst-ipv4",
             help=f"Set the initial destination IPv4 address.",
-            default=Settings.IPV4_DST,
+            default=Stream.IPV4_DST,
             type=str,
             required=False,
         )
         ip_args.add_argument(
             "--src-ipv4",
             help=f"Set the initial source IPv4 address.",
-            default=Settings.IPV4_SRC,
+            default=Stream.IPV4_SRC,
             type=str,
             required=False,
         )
         ip_args.add_argument(
             "--dst-ipv6",
             help=f"Set the initial destination IPv6 address.",
-            default=Settings.IPV6_DST,
+            default=Stream.IPV6_DST,
             type=str,
             required=False,
         )
         ip_args.add_argument(
             "--src-ipv6",
             help=f"Set the initial source IPv6 address",
-            default=Settings.IPV6_SRC,
+            default=Stream.IPV6_SRC,
             type=str,
             required=False,
         )
@@ -210,27 +366,119 @@ class CliArgs:
             required=False,
         )
 
+        tunnel_args = parser.add_argument_group("Tunnel Settings")
+        tunnel_args.add_argument(
+            "--tunnel",
+            help="Encapsulate the IP packet in an outer IP and GRE or "
+            "GTP-U header, or the inner Ethernet frame in an outer IP and "
+            "VXLAN header, after any VLAN IDs and MPLS labels. The outer UDP "
+            "source port of VXLAN and GTP-U is derived from a hash of the "
+            "inner flow.",
+            default=Stream.TUNNEL,
+            choices=["vxlan", "gre", "gtpu"],
+            required=False,
+        )
+        tunnel_args.add_argument(
+            "--tunnel-id",
+            help="Set the initial VXLAN VNI, GRE key or GTP-U TEID.",
+            default=Stream.TUNNEL_ID,
+            type=int,
+            required=False,
+        )
+        tunnel_args.add_argument(
+            "--tunnel-id-rotate",
+            help="Change the VXLAN VNI, GRE key or GTP-U TEID per-packet.",
+            default=False,
+            action="store_true",
+            required=False,
+        )
+        tunnel_args.add_argument(
+            "--tunnel-dst",
+            help="Set the outer destination IPv4 or IPv6 address.",
+            default=Stream.TUNNEL_DST,
+            type=str,
+            required=False,
+        )
+        tunnel_args.add_argument(
+            "--tunnel-src",
+            help="Set the outer source IPv4 or IPv6 address.",
+            default=Stream.TUNNEL_SRC,
+            type=str,
+            required=False,
+        )
+
+    @staticmethod
+    def create_stream_parser() -> argparse.ArgumentParser:
+        """
+        Create the CLI parser for the options of a single --stream
+        """
+        parser = argparse.ArgumentParser(
+            prog="--stream",
+            formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        )
+        CliArgs.add_stream_args(parser)
         return parser
 
     @staticmethod
-    def parse_cli_args() -> dict[str, Any]:
+    def parse_stream_args(args: dict[str, Any], idx: int) -> Stream:
         """
-        Parse the CLI args and update the settings
+        Validate the parsed options of a single stream and create the stream
         """
-        parser = CliArgs.create_parser()
-        args = vars(parser.parse_args())
+        if args["share"] < 1:
+            raise ValueError(f"--share must be >= 1, not {args['share']}")
 
-        if args["g"] < 0.0 or args["g"] > 60.0:
-            raise ValueError(f"-g must be >= 0.0 and <= 60.0, not {args['g']}")
+        if args["replay"]:
+            if (
+                args["v"]
+                or args["m"]
+                or args["l2_inner"]
+                or args["entropy_label"]
+                or args["tunnel"]
+            ):
+                raise ValueError(
+                    f"--replay can't be combined with -v, -m, --l2-inner, "
+                    f"--entropy-label or --tunnel"
+                )
+        else:
+            if args["mpls_label"] and not args["m"]:
+                raise ValueError(f"--mpls-label requires -m")
+
+            if args["vlan_id"] and not args["v"]:
+                raise ValueError(f"--vlan-id requires -v")
+
+            if args["l2_inner"] and not args["m"]:
+                raise ValueError(f"--l2-inner requires -m")
+
+            if args["entropy_label"] and not args["m"]:
+                raise ValueError(f"--entropy-label requires -m")
+
+            if args["entropy_label_rotate"] and not args["entropy_label"]:
+                raise ValueError(
+                    f"--entropy-label-rotate requires --entropy-label"
+                )
 
-        if args["mpls_label"] and not args["m"]:
-            raise ValueError(f"--mpls-label requires -m")
+            if args["tunnel_id_rotate"] and not args["tunnel"]:
+                raise ValueError(f"--tunnel-id-rotate requires --tunnel")
 
-        if args["vlan_id"] and not args["v"]:
-            raise ValueError(f"--vlan-id requires -v")
+            if args["tunnel"] and args["l2_inner"]:
+                raise ValueError(f"--tunnel can't be combined with --l2-inner")
 
-        if args["l2_inner"] and not args["m"]:
-            raise ValueError(f"--l2-inner requires -m")
+        if args["tunnel"]:
+            max_id = tunnel_id_max(args["tunnel"])
+            if args["tunnel_id"] < Settings.TUNNEL_ID_MIN or (
+                args["tunnel_id"] > max_id
+            ):
+                raise ValueError(
+                    f"--tunnel-id must be >= {Settings.TUNNEL_ID_MIN} and "
+                    f"<= {max_id}, not {args['tunnel_id']}"
+                )
+
+            if type(ipaddress.ip_address(args["tunnel_dst"])) != type(
+                ipaddress.ip_address(args["tunnel_src"])
+            ):
+                raise ValueError(
+                    f"--tunnel-dst and --tunnel-src must be the same IP version"
+                )
 
         assert (
             type(ipaddress.ip_address(args["dst_ipv4"]))
@@ -249,41 +497,163 @@ class CliArgs:
             == ipaddress.IPv6Address
         )
 
+        stream = Stream()
+        stream.ID = idx
+        stream.SHARE = args["share"]
+        stream.REPLAY = args["replay"]
+        stream.ETHERNET_DST_ROTATE = args["l2_dst"]
+        stream.ETHERNET_SRC_ROTATE = args["l2_src"]
+        stream.ETHERNET_DST = args["dst_mac"]
+        stream.ETHERNET_SRC = args["src_mac"]
+        stream.ETHERNET_INNER = args["l2_inner"]
+        stream.ETHERNET_VLAN = args["v"]
+        stream.ETHERNET_VLAN_ROTATE = args["vlan_id"]
+        stream.MPLS = args["m"]
+        stream.MPLS_ROTATE = args["mpls_label"]
+        stream.MPLS_ENTROPY_LABEL = args["entropy_label"]
+        stream.MPLS_ENTROPY_LABEL_ROTATE = args["entropy_label_rotate"]
+        stream.IP_DST_ROTATE = args["l3_dst"]
+        stream.IP_SRC_ROTATE = args["l3_src"]
+        stream.IPV4_DST = args["dst_ipv4"]
+        stream.IPV4_SRC = args["src_ipv4"]
+        stream.IPV6 = args["6"]
+        stream.IPV6_DST = args["dst_ipv6"]
+        stream.IPV6_SRC = args["src_ipv6"]
+        stream.L4_DST_ROTATE = args["l4_dst"]
+        stream.L4_SRC_ROTATE = args["l4_src"]
+        stream.UDP = args["u"]
+        stream.TUNNEL = args["tunnel"]
+        stream.TUNNEL_DST = args["tunnel_dst"]
+        stream.TUNNEL_ID = args["tunnel_id"]
+        stream.TUNNEL_ID_ROTATE = args["tunnel_id_rotate"]
+        stream.TUNNEL_SRC = args["tunnel_src"]
+
+        if (
+            stream.ETHERNET_DST_ROTATE
+            or stream.ETHERNET_SRC_ROTATE
+            or stream.ETHERNET_VLAN_ROTATE
+            or stream.MPLS_ROTATE
+            or stream.MPLS_ENTROPY_LABEL_ROTATE
+            or stream.IP_DST_ROTATE
+            or stream.IP_SRC_ROTATE
+            or stream.L4_DST_ROTATE
+            or stream.L4_SRC_ROTATE
+            or stream.TUNNEL_ID_ROTATE
+        ):
+            stream.ROTATE = True
+
+        return stream
+
+    @staticmethod
+    def parse_cli_args() -> dict[str, Any]:
+        """
+        Parse the CLI args and update the settings
+        """
+        parser = CliArgs.create_parser()
+        args = vars(parser.parse_args())
+
+        if args["g"] < 0.0 or args["g"] > 60.0:
+            raise ValueError(f"-g must be >= 0.0 and <= 60.0, not {args['g']}")
+
+        if args["c"] is not None and args["c"] < 1:
+            raise ValueError(f"-c must be >= 1, not {args['c']}")
+
+        if args["cycles"] is not None and args["cycles"] < 1:
+            raise ValueError(f"--cycles must be >= 1, not {args['cycles']}")
+
+        if args["c"] is not None and args["cycles"] is not None:
+            raise ValueError(f"-c and --cycles are exclusive")
+
+        if args["per_intf"] and args["c"] is None:
+            raise ValueError(f"--per-intf requires -c")
+
+        if args["numa_nic"] and args["numa_node"] is not None:
+            raise ValueError(f"--numa-nic and --numa-node are exclusive")
+
+        if args["cpu"] and (args["numa_nic"] or args["numa_node"] is not None):
+            raise ValueError(f"--cpu and --numa-node/--numa-nic are exclusive")
+
+        if args["numa_nic"]:
+            args["numa_node"] = nic_numa_node(args["i"][0])
+
+        # The tx thread can only be pinned to CPUs which this process may use
+        allowed_cpus = os.sched_getaffinity(0)
+        for cpu in args["cpu"]:
+            if cpu not in allowed_cpus:
+                raise ValueError(
+                    f"--cpu {cpu} is not one of the allowed CPUs "
+                    f"{sorted(allowed_cpus)}"
+                )
+
+        if args["numa_node"] is not None and not allowed_cpus.intersection(
+            numa_node_cpus(args["numa_node"])
+        ):
+            raise ValueError(
+                f"NUMA node {args['numa_node']} has none of the allowed CPUs "
+                f"{sorted(allowed_cpus)}"
+            )
+
+        if args["sched_fifo"] is not None and not (
+            1 <= args["sched_fifo"] <= 99
+        ):
+            raise ValueError(
+                f"--sched-fifo must be >= 1 and <= 99, not {args['sched_fifo']}"
+            )
+
+        if args["stream"]:
+            """
+            Parse each stream on top of the already parsed args, so that
+            every stream inherits the settings given outside of --stream.
+            The -v and -m counts are reset first, so that the counts given
+            in a stream replace the inherited counts instead of adding to
+            them.
+            """
+            stream_parser = CliArgs.create_stream_parser()
+            streams_args = []
+            for stream in args["stream"]:
+                stream_args = vars(
+                    stream_parser.parse_args(
+                        shlex.split(stream),
+                        namespace=argparse.Namespace(
+                            **{**args, "v": None, "m": None}
+                        ),
+                    )
+                )
+                for count in ["v", "m"]:
+                    if stream_args[count] is None:
+                        stream_args[count] = args[count]
+                streams_args.append(stream_args)
+        else:
+            streams_args = [args]
+
+        Settings.STREAMS = [
+            CliArgs.parse_stream_args(stream_args, idx)
+            for idx, stream_args in enumerate(streams_args)
+        ]
+
         Settings.MAX_DURATION = args["d"]
         Settings.INTER_PACKET_GAP = args["g"]
         Settings.INTERFACES = args["i"]
         Settings.RUNNING_STATS = args["s"]
         Settings.PRINT_PACKET = args["p"]
-        Settings.ETHERNET_DST_ROTATE = args["l2_dst"]
-        Settings.ETHERNET_SRC_ROTATE = args["l2_src"]
-        Settings.ETHERNET_DST = args["dst_mac"]
-        Settings.ETHERNET_SRC = args["src_mac"]
-        Settings.ETHERNET_INNER = args["l2_inner"]
-        Settings.ETHERNET_VLAN = args["v"]
-        Settings.ETHERNET_VLAN_ROTATE = args["vlan_id"]
-        Settings.MPLS = args["m"]
-        Settings.MPLS_ROTATE = args["mpls_label"]
-        Settings.IP_DST_ROTATE = args["l3_dst"]
-        Settings.IP_SRC_ROTATE = args["l3_src"]
-        Settings.IPV4_DST = args["dst_ipv4"]
-        Settings.IPV4_SRC = args["src_ipv4"]
-        Settings.IPV6 = args["6"]
-        Settings.IPV6_DST = args["dst_ipv6"]
-        Settings.IPV6_SRC = args["src_ipv6"]
-        Settings.L4_DST_ROTATE = args["l4_dst"]
-        Settings.L4_SRC_ROTATE = args["l4_src"]
-        Settings.UDP = args["u"]
+        Settings.TX_CPUS = args["cpu"]
+        Settings.TX_NUMA_NODE = args["numa_node"]
+        Settings.TX_SCHED_FIFO = args["sched_fifo"]
+        Settings.SOCKET_SNDBUF = args["sndbuf"]
+        Settings.SOCKET_PRIORITY = args["so_priority"]
+        Settings.SOCKET_BUSY_POLL = args["busy_poll"]
+        Settings.SOCKET_QDISC_BYPASS = args["qdisc_bypass"]
 
-        if (
-            Settings.ETHERNET_DST_ROTATE
-            or Settings.ETHERNET_SRC_ROTATE
-            or Settings.ETHERNET_VLAN_ROTATE
-            or Settings.MPLS_ROTATE
-            or Settings.IP_DST_ROTATE
-            or Settings.IP_SRC_ROTATE
-            or Settings.L4_DST_ROTATE
-            or Settings.L4_SRC_ROTATE
-        ):
-            Settings.ROTATE = True
+        if args["c"] is not None:
+            Settings.MAX_PACKETS = args["c"]
+            if args["per_intf"]:
+                Settings.MAX_PACKETS *= len(Settings.INTERFACES)
+
+        if args["cycles"] is not None:
+            if not any(
+                [stream.ROTATE or stream.REPLAY for stream in Settings.STREAMS]
+            ):
+                raise ValueError(f"--cycles requires a value to rotate")
+            Settings.CYCLES = args["cycles"]
 
         return args
@@ -1,20 +1,25 @@
 from __future__ import annotations
 
-from ipaddress import IPv4Address, IPv6Address, ip_address
+from ipaddress import IPv6Address, ip_address
+from math import lcm
 from textwrap import wrap
 
+from scapy.contrib.gtp import GTP_U_Header  # type: ignore
 from scapy.contrib.mpls import MPLS, EoMCW  # type: ignore
 from scapy.layers.inet import IP, TCP, UDP, Ether  # type: ignore
 from scapy.layers.inet6 import IPv6  # type: ignore
-from scapy.layers.l2 import Dot1Q  # type: ignore
-from scapy.packet import Packet  # type: ignore
+from scapy.layers.l2 import GRE, Dot1Q  # type: ignore
+from scapy.layers.vxlan import VXLAN  # type: ignore
 
 from settings import Settings
+from stream import Stream
+from template import Template, tunnel_id_max
 
 
-def build_packet() -> None:
+def build_packet(stream: Stream) -> None:
     """
-    Build the base packet
+    Build the base packet of a stream, and the template which rotates its
+    values
     """
 
     """
@@ -22,142 +27,117 @@ def build_packet() -> None:
     based on the CLI args.
     """
 
-    outer_dst_mac = Settings.ETHERNET_DST
-    inner_dst_mac = Settings.ETHERNET_DST
+    # Pseudowires and VXLAN carry an inner Ethernet header
+    inner_eth = stream.ETHERNET_INNER or stream.TUNNEL == "vxlan"
+
+    outer_dst_mac = stream.ETHERNET_DST
+    inner_dst_mac = stream.ETHERNET_DST
     """
     If --l2-src option is used, set the starting source mac to be the destination MAC + 1.
     If the source is 00:00:00:00:00:01 and destination is "00:00:00:00:00:02, the 2nd packet
     will have the same source and destination MAC, causing a MAC move (if testing EVPN).
     """
-    if Settings.ETHERNET_SRC_ROTATE:
-        if Settings.ETHERNET_INNER:
-            inner_src_mac = rotate_mac(Settings.ETHERNET_DST)
-            outer_src_mac = Settings.ETHERNET_SRC
+    if stream.ETHERNET_SRC_ROTATE:
+        if inner_eth:
+            inner_src_mac = rotate_mac(stream.ETHERNET_DST)
+            outer_src_mac = stream.ETHERNET_SRC
         else:
-            inner_src_mac = Settings.ETHERNET_SRC
-            outer_src_mac = rotate_mac(Settings.ETHERNET_DST)
+            inner_src_mac = stream.ETHERNET_SRC
+            outer_src_mac = rotate_mac(stream.ETHERNET_DST)
     else:
-        outer_src_mac = Settings.ETHERNET_SRC
-        inner_src_mac = Settings.ETHERNET_SRC
+        outer_src_mac = stream.ETHERNET_SRC
+        inner_src_mac = stream.ETHERNET_SRC
 
     vlan = Settings.ETHERNET_VLAN_MIN
 
     label = Settings.MPLS_MIN
 
-    if Settings.IPV6:
-        dst_ip = Settings.IPV6_DST
-        src_ip = Settings.IPV6_SRC
+    if stream.IPV6:
+        dst_ip = stream.IPV6_DST
+        src_ip = stream.IPV6_SRC
     else:
-        dst_ip = Settings.IPV4_DST
-        src_ip = Settings.IPV4_SRC
+        dst_ip = stream.IPV4_DST
+        src_ip = stream.IPV4_SRC
 
     dst_port = Settings.L4_MIN
     src_port = Settings.L4_MIN
 
     """
     Next, build the header stack using the defaults.
-    Record the index/layer of each header in the Scapy packet.
     """
 
     packet = Ether(dst=outer_dst_mac, src=outer_src_mac)
-    Settings.LAYER_ETH = 0
 
-    if Settings.ETHERNET_VLAN:
-        for _ in range(0, Settings.ETHERNET_VLAN):
+    if stream.ETHERNET_VLAN:
+        for _ in range(0, stream.ETHERNET_VLAN):
             packet.add_payload(Dot1Q(vlan=vlan))
-        Settings.LAYER_VLAN_FIRST = Settings.LAYER_ETH + 1  # Outer most VLAN
-        Settings.LAYER_VLAN_LAST = (
-            Settings.LAYER_ETH + Settings.ETHERNET_VLAN
-        )  # Inner most VLAN
-    else:
-        Settings.LAYER_VLAN_FIRST = Settings.LAYER_ETH
-        Settings.LAYER_VLAN_LAST = Settings.LAYER_VLAN_FIRST
 
-    if Settings.MPLS:
-        for _ in range(0, Settings.MPLS):
+    if stream.MPLS:
+        labels = [label] * stream.MPLS
+        if stream.ETHERNET_INNER:
+            # non-IP payload, start from a label which is not IP related
+            labels[-1] = Settings.MPLS_UNALLOCATED
+        if stream.MPLS_ENTROPY_LABEL:
+            """
+            Insert the ELI and EL after the outer most label (RFC 6790).
+            The template sets the EL from the hash of the inner flow.
+            """
+            labels[1:1] = [Settings.MPLS_ELI, Settings.MPLS_EL_MIN]
+        for label in labels:
             packet.add_payload(MPLS(label=label))
-        Settings.LAYER_MPLS_FIRST = Settings.LAYER_ETH + 1  # Outer most label
-        Settings.LAYER_MPLS_LAST = (
-            Settings.LAYER_ETH + Settings.MPLS
-        )  # Inner most label
-    else:
-        Settings.LAYER_MPLS_FIRST = Settings.LAYER_ETH
-        Settings.LAYER_MPLS_LAST = Settings.LAYER_MPLS_FIRST
 
-    if Settings.ETHERNET_INNER:
-        # non-IP payload, start from a label which is not IP related
-        packet[Settings.LAYER_MPLS_LAST].label = Settings.MPLS_UNALLOCATED
+    if stream.ETHERNET_INNER:
         packet.add_payload(EoMCW())
+
+    if stream.TUNNEL:
+        if type(ip_address(stream.TUNNEL_DST)) == IPv6Address:
+            packet.add_payload(
+                IPv6(dst=stream.TUNNEL_DST, src=stream.TUNNEL_SRC)
+            )
+        else:
+            packet.add_payload(
+                IP(dst=stream.TUNNEL_DST, src=stream.TUNNEL_SRC)
+            )
+
+        """
+        The template sets the UDP source port from the hash of the inner
+        flow. The UDP checksum isn't used, like most tunnel endpoints do,
+        because it would cover the inner headers which are rotated.
+        """
+        if stream.TUNNEL == "vxlan":
+            packet.add_payload(UDP(dport=Settings.VXLAN_PORT, chksum=0))
+            packet.add_payload(VXLAN(flags="Instance", vni=stream.TUNNEL_ID))
+        elif stream.TUNNEL == "gre":
+            packet.add_payload(GRE(key_present=1, key=stream.TUNNEL_ID))
+        elif stream.TUNNEL == "gtpu":
+            packet.add_payload(UDP(dport=Settings.GTPU_PORT, chksum=0))
+            packet.add_payload(GTP_U_Header(teid=stream.TUNNEL_ID))
+
+    if inner_eth:
         packet.add_payload(Ether(dst=inner_dst_mac, src=inner_src_mac))
-        Settings.LAYER_ETH_INNER = Settings.LAYER_MPLS_LAST + 2
-        Settings.LAYER_ETH_ROTATE = Settings.LAYER_ETH_INNER
-    else:
-        Settings.LAYER_ETH_INNER = Settings.LAYER_MPLS_LAST
-        Settings.LAYER_ETH_ROTATE = Settings.LAYER_ETH
 
-    if Settings.IPV6:
+    if stream.IPV6:
         packet.add_payload(IPv6(dst=dst_ip, src=src_ip))
     else:
         packet.add_payload(IP(dst=dst_ip, src=src_ip))
-    Settings.LAYER_IP = Settings.LAYER_ETH_INNER + 1
 
-    if Settings.UDP:
+    if stream.UDP:
         packet.add_payload(UDP(dport=dst_port, sport=src_port))
     else:
         packet.add_payload(TCP(dport=dst_port, sport=src_port))
-    Settings.LAYER_4 = Settings.LAYER_IP + 1
-
-    Settings.PACKET = packet
-
-    if Settings.PRINT_PACKET:
-        print("Base packet is:")
-        Settings.PACKET.show2()
-
 
-def rotate_ipv4(ip_addr: str) -> str:
     """
-    Increment an IPv4 address
+    Finally, compile the packet into a frame and a template with the byte
+    offsets of the fields which change per packet, so that rotating values
+    costs the same no matter how deep the header stack is.
     """
-    addr = int(IPv4Address(ip_addr))
-    if addr < Settings.IPV4_MAX:
-        addr += 1
-    else:
-        addr = Settings.IPV4_MIN
-    return str(ip_address(addr))
-
-
-def rotate_ipv6(ip_addr: str) -> str:
-    """
-    Increment an IPv6 address
-    """
-    addr = int(IPv6Address(ip_addr))
-    if addr < Settings.IPV6_MAX:
-        addr += 1
-    else:
-        addr = Settings.IPV6_MIN
-    return str(ip_address(addr)).upper()
-
+    stream.packet = bytearray(bytes(packet))
+    stream.templates = [Template(bytes(stream.packet), stream)]
+    stream.templates[0].rewrite(stream.packet, 0)
 
-def rotate_vlan(vlan: int) -> int:
-    """
-    Increment a VLAN ID
-    """
-    if vlan < Settings.ETHERNET_VLAN_MAX:
-        vlan += 1
-    else:
-        vlan = Settings.ETHERNET_VLAN_MIN
-    return vlan
-
-
-def rotate_label(label: int) -> int:
-    """
-    Increment an MPLS label
-    """
-    if label < Settings.MPLS_MAX:
-        label += 1
-    else:
-        label = Settings.MPLS_MIN
-    return label
+    if Settings.PRINT_PACKET:
+        print(f"Base packet of stream {stream.ID} is:")
+        Ether(bytes(stream.packet)).show2()
 
 
 def rotate_mac(mac_addr: str) -> str:
@@ -172,71 +152,57 @@ def rotate_mac(mac_addr: str) -> str:
     return ":".join(wrap(text=f"{addr:012X}", width=2))
 
 
-def rotate_port(port: int) -> int:
-    """
-    Increment a L4 port number
-    """
-    if port < Settings.L4_MAX:
-        port += 1
-    else:
-        port = Settings.L4_MIN
-    return port
-
-
-def rotate_values() -> None:
-    """
-    Rotate the values in the protocol headers until they reach they max,
-    then wrap around and start again.
-    """
-
-    assert isinstance(Settings.PACKET, Packet)  # mypy
-
-    if Settings.ETHERNET_DST_ROTATE:
-        Settings.PACKET[Settings.LAYER_ETH_ROTATE].dst = rotate_mac(
-            Settings.PACKET[Settings.LAYER_ETH_ROTATE].dst
+def rotation_length(stream: Stream) -> int:
+    """
+    Return the number of packets after which all the rotated values of a
+    stream are back at their initial values, i.e. after which every flow has
+    been sent once
+    """
+    if stream.REPLAY:
+        """
+        Every frame of a capture is rewritten starting from its captured
+        values, over the full width of each field, so the ranges depend on
+        the header layouts in the capture (e.g. IPv4 or IPv6)
+        """
+        return lcm(
+            len(stream.frame_starts),
+            *(
+                field[4]
+                for template in stream.templates
+                for field in template.fields
+            ),
         )
 
-    if Settings.ETHERNET_SRC_ROTATE:
-        Settings.PACKET[Settings.LAYER_ETH_ROTATE].src = rotate_mac(
-            Settings.PACKET[Settings.LAYER_ETH_ROTATE].src
-        )
+    lengths = [1]
 
-    if Settings.ETHERNET_VLAN_ROTATE:
-        Settings.PACKET[Settings.LAYER_VLAN_LAST].vlan = rotate_vlan(
-            Settings.PACKET[Settings.LAYER_VLAN_LAST].vlan
+    if stream.ETHERNET_DST_ROTATE or stream.ETHERNET_SRC_ROTATE:
+        lengths.append(
+            Settings.ETHERNET_MAX_ADDR - Settings.ETHERNET_MIN_ADDR + 1
         )
 
-    if Settings.MPLS_ROTATE:
-        Settings.PACKET[Settings.LAYER_MPLS_LAST].label = rotate_label(
-            Settings.PACKET[Settings.LAYER_MPLS_LAST].label
+    if stream.ETHERNET_VLAN_ROTATE:
+        lengths.append(
+            Settings.ETHERNET_VLAN_MAX - Settings.ETHERNET_VLAN_MIN + 1
         )
 
-    if Settings.IP_DST_ROTATE:
-        if Settings.IPV6:
-            Settings.PACKET[Settings.LAYER_IP].dst = rotate_ipv6(
-                Settings.PACKET[Settings.LAYER_IP].dst
-            )
-        else:
-            Settings.PACKET[Settings.LAYER_IP].dst = rotate_ipv4(
-                Settings.PACKET[Settings.LAYER_IP].dst
-            )
+    if stream.MPLS_ROTATE:
+        lengths.append(Settings.MPLS_MAX - Settings.MPLS_MIN + 1)
 
-    if Settings.IP_SRC_ROTATE:
-        if Settings.IPV6:
-            Settings.PACKET[Settings.LAYER_IP].src = rotate_ipv6(
-                Settings.PACKET[Settings.LAYER_IP].src
-            )
+    if stream.IP_DST_ROTATE or stream.IP_SRC_ROTATE:
+        if stream.IPV6:
+            lengths.append(Settings.IPV6_MAX - Settings.IPV6_MIN + 1)
         else:
-            Settings.PACKET[Settings.LAYER_IP].src = rotate_ipv4(
-                Settings.PACKET[Settings.LAYER_IP].src
-            )
+            lengths.append(Settings.IPV4_MAX - Settings.IPV4_MIN + 1)
 
-    if Settings.L4_DST_ROTATE:
-        Settings.PACKET[Settings.LAYER_4].dport = rotate_port(
-            Settings.PACKET[Settings.LAYER_4].dport
-        )
+    if stream.L4_DST_ROTATE or stream.L4_SRC_ROTATE:
+        lengths.append(Settings.L4_MAX - Settings.L4_MIN + 1)
+
+    if stream.MPLS_ENTROPY_LABEL_ROTATE:
+        lengths.append(Settings.MPLS_MAX - Settings.MPLS_EL_MIN + 1)
 
-    if Settings.L4_SRC_ROTATE:
-        Settings.PACKET[Settings.LAYER_4].sport = rotate_port(
-            Settings.PACKET[Settings.LAYER_4].sport
+    if stream.TUNNEL and stream.TUNNEL_ID_ROTATE:
+        lengths.append(
+            tunnel_id_max(stream.TUNNEL) - Settings.TUNNEL_ID_MIN + 1
         )
+
+    return lcm(*lengths)
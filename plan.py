@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Union
+
+from replay import frame_loader
+from schedule import build_schedule
+from stats import Stats
+from stream import Stream
+
+
+class TxPlan:
+    """
+    Class to store the state of the tx loop, compiled once from the streams
+    when the test starts. The tx loop only indexes into the lists and arrays
+    of the plan by stream number (slot) and interface number, instead of
+    looking up the settings of a stream and the stats of an interface for
+    every packet.
+    """
+
+    __slots__ = ("frames", "mutators", "schedule", "stats")
+
+    def __init__(self, streams: list[Stream], intfs: int) -> None:
+        # The frame which is sent next, per stream
+        self.frames: list[Union[bytes, bytearray]] = []
+        """
+        The functions which are called with the frame and the number of the
+        next packet of a stream, after its frame has been sent. Only the
+        fields which change per packet have a function, so a stream which
+        doesn't change has none.
+        """
+        self.mutators: list[list[Callable[[Any, int], None]]] = []
+        for slot, stream in enumerate(streams):
+            assert stream.packet is not None  # mypy
+            self.frames.append(stream.packet)
+            self.mutators.append(self.compile_stream(slot, stream))
+
+        # The stream number of every packet, which the tx loop cycles through
+        slots = {stream: slot for slot, stream in enumerate(streams)}
+        self.schedule = [
+            slots[stream] for stream in build_schedule(streams, intfs)
+        ]
+
+        self.stats = Stats(intfs, len(streams))
+
+    def compile_stream(
+        self, slot: int, stream: Stream
+    ) -> list[Callable[[Any, int], None]]:
+        """
+        Return the functions which prepare the next frame of a stream
+        """
+        if stream.REPLAY:
+            load = frame_loader(stream)
+            frames = self.frames
+
+            def next_frame(frame: Any, n: int) -> None:
+                frames[slot] = load(n)
+
+            return [next_frame]
+
+        if stream.ROTATE:
+            # The base packet is rewritten in place
+            return list(stream.templates[0].mutators)
+
+        return []
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import mmap
+from array import array
+from struct import unpack_from
+from typing import Callable, Union
+
+from settings import Settings
+from stream import Stream
+from template import Template, parse_frame
+
+ETHERNET_HEADER_LEN = 14
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+VLAN_HEADER_LEN = 4
+LINKTYPE_ETHERNET = 1
+PCAP_HEADER_LEN = 24
+PCAP_RECORD_LEN = 16
+PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": "<",  # Little endian, microseconds
+    b"\x4d\x3c\xb2\xa1": "<",  # Little endian, nanoseconds
+    b"\xa1\xb2\xc3\xd4": ">",  # Big endian, microseconds
+    b"\xa1\xb2\x3c\x4d": ">",  # Big endian, nanoseconds
+}
+
+
+def interface_mtu(intf: str) -> int:
+    """
+    Return the MTU of an interface, or the default Ethernet MTU if it is
+    unknown
+    """
+    try:
+        with open(f"/sys/class/net/{intf}/mtu") as f:
+            return int(f.read())
+    except FileNotFoundError:
+        return 1500
+
+
+def index_pcap(
+    capture: mmap.mmap, max_length: int
+) -> tuple[array, array, int]:
+    """
+    Return the start and end offsets of every frame in a pcap file, and the
+    number of frames which are skipped. A frame which is truncated, or which
+    is longer than max_length plus its Ethernet header (e.g. a GRO or TSO
+    frame of up to 64 KB captured on the host), can't be sent as is.
+    """
+    endian = PCAP_MAGIC.get(capture[:4])
+    if endian is None:
+        raise ValueError(f"Not a pcap file, pcapng is not supported")
+    (linktype,) = unpack_from(f"{endian}I", capture, 20)
+    if linktype != LINKTYPE_ETHERNET:
+        raise ValueError(f"Only Ethernet captures are supported")
+
+    starts = array("Q")
+    ends = array("Q")
+    skipped = 0
+    offset = PCAP_HEADER_LEN
+    while offset + PCAP_RECORD_LEN <= len(capture):
+        length, original_length = unpack_from(
+            f"{endian}II", capture, offset + 8
+        )
+        offset += PCAP_RECORD_LEN
+        if offset + length > len(capture):
+            break  # Truncated capture
+        start = offset
+        offset += length
+
+        # Like the kernel, allow a VLAN tag on top of the MTU
+        max_frame = max_length + ETHERNET_HEADER_LEN
+        if length >= ETHERNET_HEADER_LEN:
+            (ethertype,) = unpack_from("!H", capture, start + 12)
+            if ethertype in ETHERTYPE_VLAN:
+                max_frame += VLAN_HEADER_LEN
+        if length < original_length or length > max_frame:
+            skipped += 1
+            continue
+        starts.append(start)
+        ends.append(offset)
+
+    if not starts:
+        if skipped:
+            raise ValueError(
+                f"No frames in capture which are complete and fit the MTU"
+            )
+        raise ValueError(f"No frames in capture")
+    return starts, ends, skipped
+
+
+def load_replay(stream: Stream) -> None:
+    """
+    Memory map the capture of a replay stream, index its frames, and
+    precompute the rewrites of every header layout in the capture
+    """
+    assert stream.REPLAY  # mypy
+
+    with open(stream.REPLAY, "rb") as f:
+        stream.capture = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    max_length = min(interface_mtu(intf) for intf in Settings.INTERFACES)
+    stream.frame_starts, stream.frame_ends, skipped = index_pcap(
+        stream.capture, max_length
+    )
+    print(
+        f"Stream {stream.ID} replays {len(stream.frame_starts)} frames from "
+        f"{stream.REPLAY}"
+    )
+    if skipped:
+        print(
+            f"Stream {stream.ID} skips {skipped} frames which are truncated "
+            f"or larger than the MTU of {max_length}"
+        )
+
+    if stream.ROTATE:
+        """
+        Most frames of a capture have the same header layout. The frames
+        which have the same layout share one relative template, and only
+        the index of their template is stored per frame.
+        """
+        layouts: dict[tuple[int | str, ...], int] = {}
+        stream.templates = []
+        stream.frame_templates = array("I")
+        for start, end in zip(stream.frame_starts, stream.frame_ends):
+            frame = stream.capture[start:end]
+            layout = parse_frame(frame).layout()
+            if layout not in layouts:
+                layouts[layout] = len(stream.templates)
+                stream.templates.append(Template(frame, stream, relative=True))
+            stream.frame_templates.append(layouts[layout])
+
+    stream.packet = frame_loader(stream)(0)
+
+
+def frame_loader(stream: Stream) -> Callable[[int], Union[bytes, bytearray]]:
+    """
+    Return a function which returns the frame of packet number n of a replay
+    stream, looping back to the first frame after the last one
+    """
+    assert stream.capture is not None  # mypy
+
+    capture = stream.capture
+    starts = stream.frame_starts
+    ends = stream.frame_ends
+    templates = stream.templates
+    frame_templates = stream.frame_templates
+    frames = len(starts)
+
+    if stream.ROTATE:
+
+        def load(n: int) -> Union[bytes, bytearray]:
+            idx = n % frames
+            frame = bytearray(capture[starts[idx] : ends[idx]])
+            templates[frame_templates[idx]].rewrite(frame, n)
+            return frame
+
+    else:
+
+        def load(n: int) -> Union[bytes, bytearray]:
+            idx = n % frames
+            return capture[starts[idx] : ends[idx]]
+
+    return load
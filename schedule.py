@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from math import gcd, lcm
+
+from packet import rotation_length
+from stream import Stream
+
+
+def stream_weights(streams: list[Stream]) -> list[int]:
+    """
+    Return the share of each stream, reduced to the smallest whole numbers
+    """
+    divisor = gcd(*[stream.SHARE for stream in streams])
+    return [stream.SHARE // divisor for stream in streams]
+
+
+def build_schedule(streams: list[Stream], intfs: int) -> list[Stream]:
+    """
+    Build the order in which the streams are transmitted, interleaving them
+    as evenly as possible according to their share (smooth weighted
+    round-robin).
+    """
+    weights = stream_weights(streams)
+    total = sum(weights)
+    current = [0] * len(streams)
+
+    order = []
+    for _ in range(0, total):
+        for idx, weight in enumerate(weights):
+            current[idx] += weight
+        best = current.index(max(current))
+        current[best] -= total
+        order.append(streams[best])
+
+    """
+    Packets are sent round-robin across the interfaces, so interface i only
+    gets the packets at positions i, i + intfs, i + 2 * intfs, ... If the
+    number of interfaces and the length of the order have a common factor g,
+    an interface only ever gets the positions of the order which have the
+    same remainder modulo g. Repeat the order once per interface, and rotate
+    it by one every intfs / g repetitions, so that over the schedule every
+    interface gets every position of the order once. Each repetition still
+    contains every stream exactly according to its share.
+    """
+    common = gcd(total, intfs)
+    schedule = []
+    for repetition in range(0, intfs):
+        offset = repetition // (intfs // common)
+        schedule += order[offset:] + order[:offset]
+    return schedule
+
+
+def schedule_rotation_length(streams: list[Stream]) -> int:
+    """
+    Return the number of packets after which all streams have been sent
+    according to their share and all their rotated values are back at their
+    initial values, i.e. after which every flow of every stream has been sent
+    an equal number of times
+    """
+    weights = stream_weights(streams)
+    rounds = [
+        rotation_length(stream) // gcd(rotation_length(stream), weight)
+        for stream, weight in zip(streams, weights)
+    ]
+    return lcm(*rounds) * sum(weights)
@@ -1,69 +1,63 @@
 from typing import Optional
 
-from scapy.packet import Packet  # type: ignore
-
 from stats import Stats
+from stream import Stream
 
 
 class Settings:
     # L2 Settings
-    ETHERNET_DST = "00:00:00:00:00:02"
-    ETHERNET_DST_ROTATE = False
-    ETHERNET_INNER = False
     ETHERNET_MAX_ADDR = 281474976710655
     ETHERNET_MIN_ADDR = 0
-    ETHERNET_SRC = "00:00:00:00:00:01"
-    ETHERNET_SRC_ROTATE = False
-    ETHERNET_VLAN: Optional[int] = None
     ETHERNET_VLAN_MAX = 4094
     ETHERNET_VLAN_MIN = 0
-    ETHERNET_VLAN_ROTATE = False
 
     # L2.5 Settings
-    MPLS: Optional[int] = None
+    MPLS_EL_MIN = 16
+    MPLS_ELI = 7
     MPLS_MAX = 1048575
     MPLS_MIN = 0
-    MPLS_ROTATE = False
     MPLS_UNALLOCATED = 256
 
     # L3 Settings
-    IP_DST_ROTATE = False
-    IP_SRC_ROTATE = False
-    IPV4_DST = "10.201.201.2"
     IPV4_MAX = 4294967295
     IPV4_MIN = 0
-    IPV4_SRC = "10.201.201.1"
-    IPV6 = False
-    IPV6_DST = "FD00::0201:2"
     IPV6_MAX = 340282366920938463463374607431768211455
     IPV6_MIN = 0
-    IPV6_SRC = "FD00::0201:1"
 
     # L4 Settings
-    L4_DST_ROTATE = False
-    L4_SRC_ROTATE = False
     L4_MAX = 65535
     L4_MIN = 1024
-    UDP = False
+
+    # Tunnel Settings
+    GRE_KEY_MAX = 4294967295
+    GTPU_PORT = 2152
+    GTPU_TEID_MAX = 4294967295
+    TUNNEL_ID_MIN = 0
+    TUNNEL_PORT_MAX = 65535
+    TUNNEL_PORT_MIN = 49152
+    VXLAN_PORT = 4789
+    VXLAN_VNI_MAX = 16777215
 
     # Test Settings
+    CYCLES = 0
     DURATION = 0
     MAX_DURATION = 10
     INTER_PACKET_GAP = 0.0
     INTERFACES: list[str] = []
-    LAYER_ETH = 0
-    LAYER_ETH_INNER = 0
-    LAYER_ETH_ROTATE = 0
-    LAYER_VLAN_FIRST = 0
-    LAYER_VLAN_LAST = 0
-    LAYER_MPLS_FIRST = 0
-    LAYER_MPLS_LAST = 0
-    LAYER_IP = 0
-    LAYER_4 = 0
-    PACKET: Optional[Packet] = None
+    MAX_PACKETS = 0
     PRINT_PACKET = False
-    ROTATE = False
     RUNNING_STATS = False
+    STREAMS: list[Stream] = []
     STATS = Stats()
     STATS_INTERVAL = 1
+    STARTED = False
     TRANSMITTING = False
+
+    # Tx Tuning Settings
+    SOCKET_BUSY_POLL: Optional[int] = None
+    SOCKET_PRIORITY: Optional[int] = None
+    SOCKET_QDISC_BYPASS = False
+    SOCKET_SNDBUF: Optional[int] = None
+    TX_CPUS: list[int] = []
+    TX_NUMA_NODE: Optional[int] = None
+    TX_SCHED_FIFO: Optional[int] = None
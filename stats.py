@@ -1,15 +1,14 @@
-class IntfStats:
-    """
-    Class to store stats per interface
-    """
-
-    tx_pks_last = 0
-    tx_pks = 0
+from array import array
 
 
 class Stats:
     """
-    Class to store all interface stats
+    Class to store the tx counters of a test, in arrays indexed by interface
+    number and by stream number. They are preallocated when the test starts,
+    so the tx thread only has to increment them.
     """
 
-    intfs: dict[str, IntfStats] = {}
+    def __init__(self, intfs: int = 0, streams: int = 0) -> None:
+        self.intf_tx_pks = array("Q", [0]) * intfs
+        self.intf_tx_pks_last = array("Q", [0]) * intfs
+        self.stream_tx_pks = array("Q", [0]) * streams
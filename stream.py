@@ -0,0 +1,66 @@
+import mmap
+from array import array
+from typing import Any, Optional, Union
+
+
+class Stream:
+    """
+    Class to store the header settings, base packet and templates of one
+    stream of packets
+    """
+
+    # L2 Settings
+    ETHERNET_DST = "00:00:00:00:00:02"
+    ETHERNET_DST_ROTATE = False
+    ETHERNET_INNER = False
+    ETHERNET_SRC = "00:00:00:00:00:01"
+    ETHERNET_SRC_ROTATE = False
+    ETHERNET_VLAN: Optional[int] = None
+    ETHERNET_VLAN_ROTATE = False
+
+    # L2.5 Settings
+    MPLS: Optional[int] = None
+    MPLS_ENTROPY_LABEL = False
+    MPLS_ENTROPY_LABEL_ROTATE = False
+    MPLS_ROTATE = False
+
+    # L3 Settings
+    IP_DST_ROTATE = False
+    IP_SRC_ROTATE = False
+    IPV4_DST = "10.201.201.2"
+    IPV4_SRC = "10.201.201.1"
+    IPV6 = False
+    IPV6_DST = "FD00::0201:2"
+    IPV6_SRC = "FD00::0201:1"
+
+    # L4 Settings
+    L4_DST_ROTATE = False
+    L4_SRC_ROTATE = False
+    UDP = False
+
+    # Tunnel Settings
+    TUNNEL: Optional[str] = None
+    TUNNEL_DST = "10.202.202.2"
+    TUNNEL_ID = 1
+    TUNNEL_ID_ROTATE = False
+    TUNNEL_SRC = "10.202.202.1"
+
+    # Stream Settings
+    ID = 0
+    ROTATE = False
+    SHARE = 1
+
+    # Replay Settings
+    REPLAY: Optional[str] = None
+
+    def __init__(self) -> None:
+        # The frame which is sent next, and the templates which rewrite it
+        self.packet: Union[bytes, bytearray, None] = None
+        self.templates: list[Any] = []
+
+        # The memory mapped capture of a replay stream, and per frame its
+        # offsets in the capture and the index of its template
+        self.capture: Optional[mmap.mmap] = None
+        self.frame_ends = array("Q")
+        self.frame_starts = array("Q")
+        self.frame_templates = array("I")
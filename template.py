@@ -0,0 +1,839 @@
+from __future__ import annotations
+
+from struct import Struct, unpack_from
+from typing import Callable
+from zlib import crc32
+
+from settings import Settings
+from stream import Stream
+
+# A function which rewrites one field of a frame for packet number n
+Mutator = Callable[[bytearray, int], None]
+
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+IPPROTO_GRE = 47
+
+# The name of the next header, per EtherType, IP protocol and UDP port
+ETHERTYPES = {
+    0x0800: "ipv4",
+    0x6558: "eth",  # Transparent Ethernet Bridging
+    0x8100: "vlan",
+    0x86DD: "ipv6",
+    0x8847: "mpls",
+    0x8848: "mpls",
+    0x88A8: "vlan",
+}
+IPPROTOS = {
+    IPPROTO_TCP: "tcp",
+    IPPROTO_UDP: "udp",
+    IPPROTO_GRE: "gre",
+}
+UDP_PORTS = {
+    Settings.VXLAN_PORT: "vxlan",
+    Settings.GTPU_PORT: "gtpu",
+}
+
+
+class FrameOffsets:
+    """
+    Class to store the byte offsets of the inner most headers in a frame,
+    -1 if the frame doesn't have the header
+    """
+
+    eth = -1
+    vlan = -1  # VLAN TCI
+    mpls = -1  # MPLS label stack entry
+    mpls_el = -1  # MPLS Entropy Label stack entry
+    ip = -1
+    ip_version = 0
+    l4 = -1
+    l4_proto = 0
+    tunnel = ""
+    tunnel_id = -1  # VXLAN VNI, GRE key or GTP-U TEID
+    tunnel_id_size = 0
+    tunnel_udp = -1  # UDP header in front of a VXLAN or GTP-U header
+
+    def layout(self) -> tuple[int | str, ...]:
+        """
+        Return the offsets as a tuple. Frames which have the same offsets
+        have the same header layout.
+        """
+        return (
+            self.eth,
+            self.vlan,
+            self.mpls,
+            self.mpls_el,
+            self.ip,
+            self.ip_version,
+            self.l4,
+            self.l4_proto,
+            self.tunnel,
+            self.tunnel_id,
+            self.tunnel_id_size,
+            self.tunnel_udp,
+        )
+
+
+def guess_payload(frame: bytes, offset: int) -> str:
+    """
+    Guess the next header from its first nibble, for headers which have no
+    next protocol field (MPLS and GTP-U)
+    """
+    if offset >= len(frame):
+        return ""
+    version = frame[offset] >> 4
+    if version == 4:
+        return "ipv4"
+    if version == 6:
+        return "ipv6"
+    if version == 0:
+        return "cw"
+    return ""
+
+
+def parse_frame(frame: bytes) -> FrameOffsets:
+    """
+    Find the offsets of the headers in a frame. Parsing stops at the first
+    header which is unknown, or which isn't completely in the frame.
+    """
+    offsets = FrameOffsets()
+    offset = 0
+    header = "eth"
+    entropy_label = False
+
+    while header:
+        if header == "eth":
+            if offset + 14 > len(frame):
+                break
+            offsets.eth = offset
+            (ethertype,) = unpack_from("!H", frame, offset + 12)
+            header = ETHERTYPES.get(ethertype, "")
+            offset += 14
+
+        elif header == "vlan":
+            if offset + 4 > len(frame):
+                break
+            offsets.vlan = offset
+            (ethertype,) = unpack_from("!H", frame, offset + 2)
+            header = ETHERTYPES.get(ethertype, "")
+            offset += 4
+
+        elif header == "mpls":
+            if offset + 4 > len(frame):
+                break
+            (entry,) = unpack_from("!I", frame, offset)
+            if entropy_label:
+                offsets.mpls_el = offset
+                entropy_label = False
+            elif entry >> 12 == Settings.MPLS_ELI:
+                # The next label is the Entropy Label
+                entropy_label = True
+            else:
+                offsets.mpls = offset
+            offset += 4
+            if entry & 0x100:  # Bottom of stack
+                header = guess_payload(frame, offset)
+
+        elif header == "cw":
+            # Pseudowire Control-Word followed by Ethernet
+            offset += 4
+            header = "eth"
+
+        elif header == "ipv4":
+            if offset + 20 > len(frame):
+                break
+            header_len = (frame[offset] & 0x0F) * 4
+            (frag,) = unpack_from("!H", frame, offset + 6)
+            offsets.ip = offset
+            offsets.ip_version = 4
+            header = IPPROTOS.get(frame[offset + 9], "")
+            offset += header_len
+            if frag & 0x1FFF:
+                # Non-first fragments don't carry the L4 header
+                break
+
+        elif header == "ipv6":
+            if offset + 40 > len(frame):
+                break
+            offsets.ip = offset
+            offsets.ip_version = 6
+            header = IPPROTOS.get(frame[offset + 6], "")
+            offset += 40
+
+        elif header == "tcp":
+            if offset + 20 > len(frame):
+                break
+            offsets.l4 = offset
+            offsets.l4_proto = IPPROTO_TCP
+            break
+
+        elif header == "udp":
+            if offset + 8 > len(frame):
+                break
+            offsets.l4 = offset
+            offsets.l4_proto = IPPROTO_UDP
+            (dst_port,) = unpack_from("!H", frame, offset + 2)
+            header = UDP_PORTS.get(dst_port, "")
+            offset += 8
+
+        elif header == "vxlan":
+            if offset + 8 > len(frame):
+                break
+            enter_tunnel(offsets, header, offset + 4, 3, offset - 8)
+            offset += 8
+            header = "eth"
+
+        elif header == "gre":
+            if offset + 4 > len(frame):
+                break
+            flags, ethertype = unpack_from("!HH", frame, offset)
+            if flags & 0x0007:
+                break  # Only GRE version 0 is supported
+            offset += 4
+            if flags & 0x8000:  # Checksum present
+                offset += 4
+            if flags & 0x2000:  # Key present
+                enter_tunnel(offsets, header, offset, 4)
+                offset += 4
+            else:
+                enter_tunnel(offsets, header, -1, 0)
+            if flags & 0x1000:  # Sequence number present
+                offset += 4
+            header = ETHERTYPES.get(ethertype, "")
+
+        elif header == "gtpu":
+            if offset + 8 > len(frame):
+                break
+            flags = frame[offset]
+            if frame[offset + 1] != 255:
+                break  # Only G-PDUs carry user traffic
+            enter_tunnel(offsets, header, offset + 4, 4, offset - 8)
+            offset += 8
+            if flags & 0x07:
+                # Sequence number, N-PDU number and extension headers
+                if offset + 4 > len(frame):
+                    break
+                extension = frame[offset + 3]
+                offset += 4
+                while extension and offset < len(frame):
+                    extension_len = frame[offset] * 4
+                    if not extension_len or offset + extension_len > len(
+                        frame
+                    ):
+                        break
+                    extension = frame[offset + extension_len - 1]
+                    offset += extension_len
+                if extension:
+                    break
+            header = guess_payload(frame, offset)
+            if header == "cw":
+                break
+
+        else:
+            break
+
+    return offsets
+
+
+def enter_tunnel(
+    offsets: FrameOffsets,
+    tunnel: str,
+    tunnel_id: int,
+    tunnel_id_size: int,
+    tunnel_udp: int = -1,
+) -> None:
+    """
+    Record the tunnel header, and forget the outer IP and L4 headers so that
+    only the headers inside of the tunnel are rewritten
+    """
+    offsets.tunnel = tunnel
+    offsets.tunnel_udp = tunnel_udp
+    offsets.tunnel_id = tunnel_id
+    offsets.tunnel_id_size = tunnel_id_size
+    offsets.ip = -1
+    offsets.ip_version = 0
+    offsets.l4 = -1
+    offsets.l4_proto = 0
+
+
+def tunnel_id_max(tunnel: str) -> int:
+    """
+    Return the max VXLAN VNI, GRE key or GTP-U TEID
+    """
+    return {
+        "vxlan": Settings.VXLAN_VNI_MAX,
+        "gre": Settings.GRE_KEY_MAX,
+        "gtpu": Settings.GTPU_TEID_MAX,
+    }[tunnel]
+
+
+def field_reader(size: int) -> Callable[[bytes, int], int]:
+    """
+    Return a function which reads a big endian value of size bytes from a
+    frame at an offset, the counterpart of field_writer()
+    """
+    if size == 2:
+        unpack_16 = Struct("!H").unpack_from
+
+        def read(frame: bytes, offset: int) -> int:
+            return unpack_16(frame, offset)[0]
+
+    elif size == 4:
+        unpack_32 = Struct("!I").unpack_from
+
+        def read(frame: bytes, offset: int) -> int:
+            return unpack_32(frame, offset)[0]
+
+    elif size == 6:
+        unpack_48 = Struct("!HI").unpack_from
+
+        def read(frame: bytes, offset: int) -> int:
+            high, low = unpack_48(frame, offset)
+            return high << 32 | low
+
+    elif size == 16:
+        unpack_128 = Struct("!QQ").unpack_from
+
+        def read(frame: bytes, offset: int) -> int:
+            high, low = unpack_128(frame, offset)
+            return high << 64 | low
+
+    else:
+
+        def read(frame: bytes, offset: int) -> int:
+            return int.from_bytes(frame[offset : offset + size], "big")
+
+    return read
+
+
+def field_writer(size: int) -> Callable[[bytearray, int, int], None]:
+    """
+    Return a function which writes a big endian value of size bytes into a
+    frame at an offset. Fields of 2, 4, 6 and 16 bytes are written with a
+    single struct call, which is a lot faster than int.to_bytes() and a slice
+    assignment.
+    """
+    if size == 2:
+        return Struct("!H").pack_into
+    if size == 4:
+        return Struct("!I").pack_into
+    if size == 6:
+        pack_48 = Struct("!HI").pack_into
+
+        def write(frame: bytearray, offset: int, value: int) -> None:
+            pack_48(frame, offset, value >> 32, value & 0xFFFFFFFF)
+
+    elif size == 16:
+        pack_128 = Struct("!QQ").pack_into
+
+        def write(frame: bytearray, offset: int, value: int) -> None:
+            pack_128(frame, offset, value >> 64, value & 0xFFFFFFFFFFFFFFFF)
+
+    else:
+
+        def write(frame: bytearray, offset: int, value: int) -> None:
+            frame[offset : offset + size] = value.to_bytes(size, "big")
+
+    return write
+
+
+def compile_mutators(
+    fields: list[tuple[int, int, int, int, int, int, int, list[int]]],
+    checksums: list[list[int]],
+    hashed: list[tuple[int, int, int, int, int, int]],
+    flow: list[tuple[int, int]],
+) -> list[Mutator]:
+    """
+    Compile the fields of a template into a short list of functions, one per
+    rewritten field, one per checksum, and one for all the hashed fields.
+    Each function is specialised for its field when the template is built,
+    so rewriting a frame doesn't have to interpret the field tuples again
+    for every packet.
+    """
+    mutators: list[Mutator] = []
+
+    for offset, size, min_value, initial, span, shift, mask, _ in fields:
+        mutators.append(
+            field_mutator(offset, size, min_value, initial, span, shift, mask)
+        )
+
+    for idx, (offset, unchanged, _) in enumerate(checksums):
+        mutators.append(
+            checksum_mutator(
+                offset,
+                unchanged,
+                [field[2:7] for field in fields if idx in field[7]],
+            )
+        )
+
+    # The hash covers the rewritten inner flow, so it is updated last
+    if hashed:
+        mutators.append(hash_mutator(hashed, flow))
+
+    return mutators
+
+
+def compile_relative_mutators(
+    fields: list[tuple[int, int, int, int, int, int, int, list[int]]],
+    checksums: list[list[int]],
+    hashed: list[tuple[int, int, int, int, int, int]],
+    flow: list[tuple[int, int]],
+) -> list[Mutator]:
+    """
+    Compile the fields of a relative template into a short list of
+    functions, one per rewritten field, which also updates the checksums
+    which cover the field, and one for all the hashed fields
+    """
+    mutators: list[Mutator] = []
+
+    for offset, size, min_value, _, span, shift, mask, idxs in fields:
+        mutators.append(
+            relative_field_mutator(
+                offset,
+                size,
+                min_value,
+                span,
+                shift,
+                mask,
+                [(checksums[idx][0], bool(checksums[idx][2])) for idx in idxs],
+            )
+        )
+
+    # The hash covers the rewritten inner flow, so it is updated last
+    if hashed:
+        mutators.append(hash_mutator(hashed, flow, relative=True))
+
+    return mutators
+
+
+def field_mutator(
+    offset: int,
+    size: int,
+    min_value: int,
+    initial: int,
+    span: int,
+    shift: int,
+    mask: int,
+) -> Mutator:
+    """
+    Return a function which writes the value of a field for packet number n
+    """
+    write = field_writer(size)
+
+    if shift or mask:
+
+        def mutate(frame: bytearray, n: int) -> None:
+            value = (min_value + (initial + n) % span) << shift | mask
+            write(frame, offset, value)
+
+    else:
+
+        def mutate(frame: bytearray, n: int) -> None:
+            write(frame, offset, min_value + (initial + n) % span)
+
+    return mutate
+
+
+def checksum_mutator(
+    offset: int,
+    unchanged: int,
+    fields: list[tuple[int, int, int, int, int]],
+) -> Mutator:
+    """
+    Return a function which writes a checksum for packet number n, given
+    the sum of the words which are not rewritten and the
+    (min, initial - min, range, shift, mask) of the fields which it covers
+    """
+    write = field_writer(2)
+
+    def mutate(frame: bytearray, n: int) -> None:
+        total = unchanged
+        for min_value, initial, span, shift, mask in fields:
+            total += (min_value + (initial + n) % span) << shift | mask
+        """
+        A one's complement sum of 16-bit words is the same as the value of
+        those bytes modulo 0xFFFF, so the words of the rewritten values don't
+        need to be summed one by one
+        """
+        write(frame, offset, 0xFFFF - total % 0xFFFF)
+
+    return mutate
+
+
+def relative_field_mutator(
+    offset: int,
+    size: int,
+    min_value: int,
+    span: int,
+    shift: int,
+    mask: int,
+    checksums: list[tuple[int, bool]],
+) -> Mutator:
+    """
+    Return a function which adds n to the value of a field in the frame,
+    given the mask of the bits of the field, and updates the checksums at
+    the given offsets. An optional checksum is left at zero, which means
+    the frame has no checksum.
+    """
+    read = field_reader(size)
+    write = field_writer(size)
+    read_checksum = field_reader(2)
+    write_checksum = field_writer(2)
+
+    def mutate(frame: bytearray, n: int) -> None:
+        original = read(frame, offset)
+        value = (original & mask) >> shift
+        value = (min_value + (value - min_value + n) % span) << shift
+        value |= original & ~mask
+        write(frame, offset, value)
+        for checksum_offset, optional in checksums:
+            checksum = read_checksum(frame, checksum_offset)
+            if optional and not checksum:
+                continue
+            total = 0xFFFF - checksum - original + value
+            write_checksum(frame, checksum_offset, 0xFFFF - total % 0xFFFF)
+
+    return mutate
+
+
+def hash_mutator(
+    hashed: list[tuple[int, int, int, int, int, int]],
+    flow: list[tuple[int, int]],
+    relative: bool = False,
+) -> Mutator:
+    """
+    Return a function which writes the hashed fields from a hash of the
+    flow in the frame. For a relative template, mask holds the bits of the
+    field, and the other bits are kept from the frame.
+    """
+    fields = [
+        (
+            field_reader(size),
+            field_writer(size),
+            offset,
+            min_value,
+            span,
+            shift,
+            mask,
+        )
+        for offset, size, min_value, span, shift, mask in hashed
+    ]
+
+    def hash_flow(frame: bytearray) -> int:
+        flow_hash = 0
+        for start, end in flow:
+            flow_hash = crc32(frame[start:end], flow_hash)
+        return flow_hash
+
+    if relative:
+
+        def mutate(frame: bytearray, n: int) -> None:
+            flow_hash = hash_flow(frame)
+            for read, write, offset, min_value, span, shift, mask in fields:
+                value = (min_value + flow_hash % span) << shift
+                write(frame, offset, value | read(frame, offset) & ~mask)
+
+    else:
+
+        def mutate(frame: bytearray, n: int) -> None:
+            flow_hash = hash_flow(frame)
+            for _, write, offset, min_value, span, shift, mask in fields:
+                write(
+                    frame,
+                    offset,
+                    (min_value + flow_hash % span) << shift | mask,
+                )
+
+    return mutate
+
+
+class Template:
+    """
+    Rewrite the rotated header fields of a frame at precomputed byte offsets.
+    Packet number n gets the initial value of each field plus n, wrapping
+    around within the range of the field in Settings. Checksums are updated
+    incrementally (RFC 1624), so a frame which has a bad checksum keeps a bad
+    checksum.
+
+    A relative template only keeps the offsets of the headers in the frame.
+    It rewrites any frame which has the same header layout, starting from
+    the values in that frame, so all the frames of a capture which have the
+    same layout can share one template.
+    """
+
+    def __init__(
+        self, frame: bytes, stream: Stream, relative: bool = False
+    ) -> None:
+        offsets = parse_frame(frame)
+
+        """
+        Each field is (offset, size, min, initial - min, range, shift, mask,
+        checksums). The value is written shifted left by shift, combined
+        with mask, which holds the original bits outside of the field. For a
+        relative template, mask holds the bits of the field instead, initial
+        isn't used and the range is the full width of the field.
+        """
+        self.fields: list[
+            tuple[int, int, int, int, int, int, int, list[int]]
+        ] = []
+        """
+        Each checksum is [offset, sum of the words which are not rewritten,
+        optional]. An optional checksum of zero means there is no checksum.
+        """
+        self.checksums: list[list[int]] = []
+        """
+        Each hashed field is (offset, size, min, range, shift, mask), mask
+        being the same as for the fields. Its
+        value is derived from a hash of the inner flow, the way a tunnel
+        endpoint or an ingress LSR derives it. The flow is the list of
+        (start, end) byte ranges which are hashed.
+        """
+        self.hashed: list[tuple[int, int, int, int, int, int]] = []
+        self.flow: list[tuple[int, int]] = []
+
+        def add_field(
+            offset: int,
+            size: int,
+            min_value: int,
+            max_value: int,
+            bits: int = 0,
+            shift: int = 0,
+            checksums: tuple[int, ...] = (),
+        ) -> None:
+            value_mask = ((1 << (bits or size * 8)) - 1) << shift
+            if relative:
+                """
+                A captured value is rotated over the full width of the
+                field, not clamped into the range of generated values, so
+                that packet n gets the captured value plus n and a cycle
+                ends back at the captured value. A field with a fixed value
+                keeps it.
+                """
+                if max_value > min_value:
+                    min_value, max_value = 0, value_mask >> shift
+                self.fields.append(
+                    (
+                        offset,
+                        size,
+                        min_value,
+                        0,
+                        max_value - min_value + 1,
+                        shift,
+                        value_mask,
+                        list(checksums),
+                    )
+                )
+                return
+
+            original = int.from_bytes(frame[offset : offset + size], "big")
+            value = (original & value_mask) >> shift
+            value = min(max(value, min_value), max_value)
+            for idx in checksums:
+                self.checksums[idx][1] -= original
+            self.fields.append(
+                (
+                    offset,
+                    size,
+                    min_value,
+                    value - min_value,
+                    max_value - min_value + 1,
+                    shift,
+                    original & ~value_mask,
+                    list(checksums),
+                )
+            )
+
+        def add_hashed(
+            offset: int,
+            size: int,
+            min_value: int,
+            max_value: int,
+            bits: int = 0,
+            shift: int = 0,
+        ) -> None:
+            original = int.from_bytes(frame[offset : offset + size], "big")
+            value_mask = ((1 << (bits or size * 8)) - 1) << shift
+            self.hashed.append(
+                (
+                    offset,
+                    size,
+                    min_value,
+                    max_value - min_value + 1,
+                    shift,
+                    value_mask if relative else original & ~value_mask,
+                )
+            )
+
+        def add_checksum(offset: int, optional: bool = False) -> int:
+            (checksum,) = unpack_from("!H", frame, offset)
+            self.checksums.append([offset, 0xFFFF - checksum, int(optional)])
+            return len(self.checksums) - 1
+
+        if offsets.eth != -1:
+            if stream.ETHERNET_DST_ROTATE:
+                add_field(
+                    offsets.eth,
+                    6,
+                    Settings.ETHERNET_MIN_ADDR,
+                    Settings.ETHERNET_MAX_ADDR,
+                )
+            if stream.ETHERNET_SRC_ROTATE:
+                add_field(
+                    offsets.eth + 6,
+                    6,
+                    Settings.ETHERNET_MIN_ADDR,
+                    Settings.ETHERNET_MAX_ADDR,
+                )
+
+        if offsets.vlan != -1 and stream.ETHERNET_VLAN_ROTATE:
+            # The VLAN ID is the lower 12 bits of the TCI
+            add_field(
+                offsets.vlan,
+                2,
+                Settings.ETHERNET_VLAN_MIN,
+                Settings.ETHERNET_VLAN_MAX,
+                bits=12,
+            )
+
+        if offsets.mpls != -1 and stream.MPLS_ROTATE:
+            # The label is the upper 20 bits of the label stack entry
+            add_field(
+                offsets.mpls,
+                4,
+                Settings.MPLS_MIN,
+                Settings.MPLS_MAX,
+                bits=20,
+                shift=12,
+            )
+
+        if offsets.mpls_el != -1:
+            if stream.MPLS_ENTROPY_LABEL_ROTATE:
+                add_field(
+                    offsets.mpls_el,
+                    4,
+                    Settings.MPLS_EL_MIN,
+                    Settings.MPLS_MAX,
+                    bits=20,
+                    shift=12,
+                )
+            else:
+                add_hashed(
+                    offsets.mpls_el,
+                    4,
+                    Settings.MPLS_EL_MIN,
+                    Settings.MPLS_MAX,
+                    bits=20,
+                    shift=12,
+                )
+
+        if offsets.tunnel_id != -1 and stream.TUNNEL_ID_ROTATE:
+            add_field(
+                offsets.tunnel_id,
+                offsets.tunnel_id_size,
+                Settings.TUNNEL_ID_MIN,
+                tunnel_id_max(offsets.tunnel),
+            )
+
+        if offsets.tunnel_udp != -1:
+            add_hashed(
+                offsets.tunnel_udp,
+                2,
+                Settings.TUNNEL_PORT_MIN,
+                Settings.TUNNEL_PORT_MAX,
+            )
+            # A UDP checksum would cover the rewritten inner headers
+            if relative or unpack_from("!H", frame, offsets.tunnel_udp + 6)[0]:
+                add_field(offsets.tunnel_udp + 6, 2, 0, 0)
+
+        if self.hashed:
+            if offsets.ip_version == 4:
+                self.flow.append((offsets.ip + 12, offsets.ip + 20))
+            elif offsets.ip_version == 6:
+                self.flow.append((offsets.ip + 8, offsets.ip + 40))
+            elif offsets.eth != -1:
+                self.flow.append((offsets.eth, offsets.eth + 12))
+            if offsets.l4 != -1:
+                self.flow.append((offsets.l4, offsets.l4 + 4))
+
+        ip_rotate = stream.IP_DST_ROTATE or stream.IP_SRC_ROTATE
+        l4_rotate = stream.L4_DST_ROTATE or stream.L4_SRC_ROTATE
+        if offsets.ip != -1 and (ip_rotate or l4_rotate):
+            checksums = []
+            if offsets.ip_version == 4 and ip_rotate:
+                checksums.append(add_checksum(offsets.ip + 10))
+
+            l4_checksums = []
+            if offsets.l4 != -1:
+                l4_checksum = offsets.l4 + (
+                    16 if offsets.l4_proto == IPPROTO_TCP else 6
+                )
+                # A UDP checksum of zero means there is no checksum (IPv4 only)
+                optional = (
+                    offsets.l4_proto == IPPROTO_UDP and offsets.ip_version == 4
+                )
+                if (
+                    relative
+                    or not optional
+                    or unpack_from("!H", frame, l4_checksum)[0]
+                ):
+                    l4_checksums.append(add_checksum(l4_checksum, optional))
+
+            if ip_rotate:
+                if offsets.ip_version == 4:
+                    size, dst, src = 4, 16, 12
+                    min_addr, max_addr = Settings.IPV4_MIN, Settings.IPV4_MAX
+                else:
+                    size, dst, src = 16, 24, 8
+                    min_addr, max_addr = Settings.IPV6_MIN, Settings.IPV6_MAX
+                # The L4 checksum covers the IP addresses in the pseudo header
+                if stream.IP_DST_ROTATE:
+                    add_field(
+                        offsets.ip + dst,
+                        size,
+                        min_addr,
+                        max_addr,
+                        checksums=tuple(checksums + l4_checksums),
+                    )
+                if stream.IP_SRC_ROTATE:
+                    add_field(
+                        offsets.ip + src,
+                        size,
+                        min_addr,
+                        max_addr,
+                        checksums=tuple(checksums + l4_checksums),
+                    )
+
+            if offsets.l4 != -1:
+                if stream.L4_DST_ROTATE:
+                    add_field(
+                        offsets.l4 + 2,
+                        2,
+                        Settings.L4_MIN,
+                        Settings.L4_MAX,
+                        checksums=tuple(l4_checksums),
+                    )
+                if stream.L4_SRC_ROTATE:
+                    add_field(
+                        offsets.l4,
+                        2,
+                        Settings.L4_MIN,
+                        Settings.L4_MAX,
+                        checksums=tuple(l4_checksums),
+                    )
+
+        if relative:
+            self.mutators = compile_relative_mutators(
+                self.fields, self.checksums, self.hashed, self.flow
+            )
+        else:
+            self.mutators = compile_mutators(
+                self.fields, self.checksums, self.hashed, self.flow
+            )
+
+    def rewrite(self, frame: bytearray, n: int) -> None:
+        """
+        Write the field values of packet number n into the frame
+        """
+        for mutate in self.mutators:
+            mutate(frame, n)
@@ -8,6 +8,7 @@ function help()
     echo "fix-lint       Fix linting problems"
     echo "lint           Run the code linters"
     echo "mypy           Type check the code"
+    echo "test           Run the unit tests"
     echo ""
     exit 1
 }
@@ -33,6 +34,11 @@ function mypy()
     command mypy ./
 }
 
+function test()
+{
+    python3 -m pytest "$@"
+}
+
 if [ $# -eq 0 ] || [ "$1" == "-h" ] || [ "$1" == "--help" ] || [ "$1" == "help" ]  ; then
   help
 fi
@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any
+
+import pytest
+from scapy.layers.inet import IP, TCP, UDP, Ether  # type: ignore
+from scapy.layers.inet6 import IPv6  # type: ignore
+from scapy.layers.l2 import Dot1Q  # type: ignore
+from scapy.packet import Raw  # type: ignore
+from scapy.utils import PcapWriter, wrpcap  # type: ignore
+
+from packet import build_packet, rotation_length
+from plan import TxPlan
+from replay import load_replay
+from settings import Settings
+from stream import Stream
+
+
+def make_stream(idx: int, **settings: Any) -> Stream:
+    stream = Stream()
+    stream.ID = idx
+    for name, value in settings.items():
+        setattr(stream, name, value)
+    stream.ROTATE = any(
+        value for name, value in settings.items() if name.endswith("_ROTATE")
+    )
+    return stream
+
+
+def transmit(plan: TxPlan, packets: int) -> list[tuple[int, bytes]]:
+    """
+    Run the tx loop of Tx.tx without sockets, returning the stream number
+    and the bytes of every frame which would have been sent
+    """
+    sent = []
+    slots = iter(plan.schedule * (packets // len(plan.schedule) + 1))
+    stream_tx_pks = plan.stats.stream_tx_pks
+    for _ in range(0, packets):
+        slot = next(slots)
+        frame = plan.frames[slot]
+        sent.append((slot, bytes(frame)))
+        n = stream_tx_pks[slot] + 1
+        stream_tx_pks[slot] = n
+        for mutate in plan.mutators[slot]:
+            mutate(frame, n)
+    return sent
+
+
+def assert_checksums(frame: bytes) -> None:
+    """
+    Recompute every IPv4, TCP and UDP checksum in the frame with scapy. A
+    UDP checksum of zero means the frame has no checksum.
+    """
+    packet = Ether(frame)
+    for layer in packet.iterpayloads():
+        if isinstance(layer, (IP, TCP)) or (
+            isinstance(layer, UDP) and layer.chksum
+        ):
+            del layer.chksum
+    assert bytes(packet) == frame
+
+
+@pytest.mark.parametrize(
+    "settings",
+    [
+        {"L4_SRC_ROTATE": True, "IP_SRC_ROTATE": True},
+        {"L4_DST_ROTATE": True, "IP_DST_ROTATE": True, "UDP": True},
+        {"IPV6": True, "L4_SRC_ROTATE": True, "IP_DST_ROTATE": True},
+        {"ETHERNET_VLAN_ROTATE": True, "ETHERNET_SRC_ROTATE": True},
+        {"MPLS": 1, "MPLS_ENTROPY_LABEL": True, "L4_SRC_ROTATE": True},
+        {"MPLS": 1, "MPLS_ROTATE": True, "MPLS_ENTROPY_LABEL_ROTATE": True},
+        {"TUNNEL": "vxlan", "TUNNEL_ID_ROTATE": True, "L4_SRC_ROTATE": True},
+        {"TUNNEL": "gre", "IP_SRC_ROTATE": True},
+        {"TUNNEL": "gtpu", "TUNNEL_ID_ROTATE": True, "UDP": True},
+    ],
+)
+def test_generated_frames_have_valid_checksums(
+    settings: dict[str, Any]
+) -> None:
+    """
+    The mutators rewrite the frames in place and update the checksums
+    incrementally, which must match the checksums scapy computes
+    """
+    streams = [make_stream(0, **settings), make_stream(1, UDP=True)]
+    for stream in streams:
+        build_packet(stream)
+    plan = TxPlan(streams, 2)
+
+    sent = transmit(plan, 64)
+    for _, frame in sent:
+        assert_checksums(frame)
+
+    # Every frame of the rotated stream differs, the other stream doesn't
+    rotated = [frame for slot, frame in sent if slot == 0]
+    assert len(set(rotated)) == len(rotated)
+    assert len({frame for slot, frame in sent if slot == 1}) == 1
+
+
+def test_generated_values_are_rotated_per_packet() -> None:
+    stream = make_stream(0, L4_SRC_ROTATE=True, IP_DST_ROTATE=True)
+    build_packet(stream)
+    plan = TxPlan([stream], 1)
+
+    frames = [Ether(frame) for _, frame in transmit(plan, 10)]
+    sports = [frame[TCP].sport for frame in frames]
+    assert sports == list(range(sports[0], sports[0] + 10))
+    assert sports[0] == Settings.L4_MIN
+    dsts = [frame[IP].dst for frame in frames]
+    assert dsts[1:] == [f"10.201.201.{n}" for n in range(3, 12)]
+
+
+def write_capture(path: Path, frames: list[Any]) -> str:
+    wrpcap(str(path), frames)
+    return str(path)
+
+
+def test_replay_rotates_from_the_captured_values(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Captured values are rotated over the full width of the field, without
+    clamping them into the ranges of generated packets
+    """
+    monkeypatch.setattr(Settings, "INTERFACES", ["test0"])
+    capture = write_capture(
+        tmp_path / "replay.pcap",
+        [
+            Ether() / Dot1Q(vlan=4095) / IP() / UDP(sport=443) / Raw(b"x" * 8),
+            Ether() / IPv6() / TCP(sport=65535) / Raw(b"y" * 8),
+        ],
+    )
+    stream = make_stream(
+        0, REPLAY=capture, L4_SRC_ROTATE=True, ETHERNET_VLAN_ROTATE=True
+    )
+    load_replay(stream)
+    plan = TxPlan([stream], 1)
+
+    sent = [frame for _, frame in transmit(plan, 6)]
+    for frame in sent:
+        assert_checksums(frame)
+    frames = [Ether(frame) for frame in sent]
+    assert [frame[Dot1Q].vlan for frame in frames[::2]] == [4095, 1, 3]
+    assert [frame[UDP].sport for frame in frames[::2]] == [443, 445, 447]
+    assert [frame[TCP].sport for frame in frames[1::2]] == [0, 2, 4]
+
+    # The IPv6 frame doesn't change the length of a cycle of the ports
+    assert rotation_length(stream) == 2**16
+
+
+def test_replay_skips_truncated_and_oversized_frames(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(Settings, "INTERFACES", ["test0"])
+    path = tmp_path / "replay.pcap"
+    writer = PcapWriter(str(path), linktype=1)
+    writer.write(Ether() / IP() / UDP() / Raw(b"x" * 1472))
+    writer.write(Ether() / Dot1Q() / IP() / UDP() / Raw(b"x" * 1472))
+    writer.write(Ether() / IP() / UDP() / Raw(b"x" * 1473))
+    # A frame which was captured with a snap length of 64
+    frame = bytes(Ether() / IP() / UDP() / Raw(b"x" * 100))
+    writer.write_packet(frame[:64], wirelen=len(frame))
+    writer.close()
+
+    stream = make_stream(0, REPLAY=str(path))
+    load_replay(stream)
+    assert len(stream.frame_starts) == 2
+    assert list(stream.frame_ends) == [
+        start + length
+        for start, length in zip(stream.frame_starts, (1514, 1518))
+    ]
+
+
+def test_replay_without_frames_which_fit_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(Settings, "INTERFACES", ["test0"])
+    capture = write_capture(
+        tmp_path / "replay.pcap", [Ether() / IP() / Raw(b"x" * 60000)]
+    )
+    with pytest.raises(ValueError, match="fit the MTU"):
+        load_replay(make_stream(0, REPLAY=capture))
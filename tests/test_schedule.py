@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from collections import Counter
+
+import pytest
+
+from schedule import build_schedule, stream_weights
+from stream import Stream
+
+
+def make_streams(shares: tuple[int, ...]) -> list[Stream]:
+    streams = []
+    for idx, share in enumerate(shares):
+        stream = Stream()
+        stream.ID = idx
+        stream.SHARE = share
+        streams.append(stream)
+    return streams
+
+
+@pytest.mark.parametrize(
+    "shares,intfs",
+    [
+        ((1,), 3),
+        ((1, 1), 1),
+        ((1, 1), 2),
+        ((1, 1), 4),
+        ((1, 1), 8),
+        ((1, 1, 1), 9),
+        ((3, 1), 8),
+        ((2, 1), 6),
+        ((1, 1, 1, 1), 8),
+        ((4, 2, 2), 12),
+        ((5, 3), 7),
+    ],
+)
+def test_every_interface_gets_every_stream(
+    shares: tuple[int, ...], intfs: int
+) -> None:
+    """
+    Every interface must send every stream according to its share, over
+    one round-robin pass of the schedule per interface
+    """
+    streams = make_streams(shares)
+    schedule = build_schedule(streams, intfs)
+    weights = stream_weights(streams)
+
+    for intf in range(0, intfs):
+        sent = Counter(
+            schedule[packet % len(schedule)].ID
+            for packet in range(intf, len(schedule) * intfs, intfs)
+        )
+        assert sum(sent.values()) == len(schedule)
+        for stream, weight in zip(streams, weights):
+            assert sent[stream.ID] * sum(weights) == weight * len(schedule)
+
+
+@pytest.mark.parametrize(
+    "shares,intfs", [((1, 1), 4), ((3, 1), 8), ((2, 2, 1), 10)]
+)
+def test_schedule_is_exact_after_every_order(
+    shares: tuple[int, ...], intfs: int
+) -> None:
+    """
+    --cycles relies on every stream having been sent exactly according to
+    its share after every sum(weights) packets
+    """
+    streams = make_streams(shares)
+    schedule = build_schedule(streams, intfs)
+    weights = stream_weights(streams)
+    total = sum(weights)
+
+    for rounds in range(1, len(schedule) // total + 1):
+        sent = Counter(stream.ID for stream in schedule[: rounds * total])
+        for stream, weight in zip(streams, weights):
+            assert sent[stream.ID] == rounds * weight
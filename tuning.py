@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import errno
+import os
+import socket
+
+from settings import Settings
+
+# Linux socket option values which are not exported by the socket module
+SOL_PACKET = 263
+PACKET_QDISC_BYPASS = 20
+SO_BUSY_POLL = 46
+SO_SNDBUFFORCE = 32
+
+
+def parse_cpu_list(cpu_list: str) -> list[int]:
+    """
+    Parse a Linux CPU list such as "0-3,8,10-11"
+    """
+    cpus: list[int] = []
+    for cpu_range in cpu_list.strip().split(","):
+        if not cpu_range:
+            continue
+        first, _, last = cpu_range.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def numa_node_cpus(node: int) -> list[int]:
+    """
+    Return the CPUs which belong to a NUMA node
+    """
+    try:
+        with open(f"/sys/devices/system/node/node{node}/cpulist") as f:
+            return parse_cpu_list(f.read())
+    except FileNotFoundError:
+        raise ValueError(f"NUMA node {node} doesn't exist")
+
+
+def nic_numa_node(intf: str) -> int:
+    """
+    Return the NUMA node which a NIC is attached to
+    """
+    try:
+        with open(f"/sys/class/net/{intf}/device/numa_node") as f:
+            node = int(f.read())
+    except FileNotFoundError:
+        node = -1
+    if node < 0:
+        raise ValueError(f"No NUMA node is known for interface {intf}")
+    return node
+
+
+def tune_thread() -> list[str]:
+    """
+    Apply the CPU affinity and scheduling settings to the calling thread.
+    Return a description of what was applied.
+    """
+    applied = []
+
+    cpus = Settings.TX_CPUS
+    if Settings.TX_NUMA_NODE is not None:
+        cpus = numa_node_cpus(Settings.TX_NUMA_NODE)
+    if cpus:
+        # On Linux PID 0 is the calling thread, not the whole process
+        os.sched_setaffinity(0, cpus)
+    applied.append(f"CPU affinity: {sorted(os.sched_getaffinity(0))}")
+
+    if Settings.TX_SCHED_FIFO is not None:
+        try:
+            os.sched_setscheduler(
+                0, os.SCHED_FIFO, os.sched_param(Settings.TX_SCHED_FIFO)
+            )
+            applied.append(f"Scheduler: SCHED_FIFO {Settings.TX_SCHED_FIFO}")
+        except PermissionError:
+            applied.append("Scheduler: SCHED_OTHER (SCHED_FIFO not permitted)")
+    else:
+        applied.append("Scheduler: SCHED_OTHER")
+
+    return applied
+
+
+def tune_socket(intf: str, sock: socket.socket) -> list[str]:
+    """
+    Apply the socket settings to a transmit socket.
+    Return a description of what was applied.
+    """
+    applied = []
+
+    if Settings.SOCKET_SNDBUF is not None:
+        try:
+            # Allowed to exceed net.core.wmem_max when running as root
+            sock.setsockopt(
+                socket.SOL_SOCKET, SO_SNDBUFFORCE, Settings.SOCKET_SNDBUF
+            )
+        except PermissionError:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, Settings.SOCKET_SNDBUF
+            )
+    sndbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)
+    applied.append(f"SO_SNDBUF: {sndbuf}")
+
+    not_permitted = ""
+    if Settings.SOCKET_PRIORITY is not None:
+        try:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_PRIORITY, Settings.SOCKET_PRIORITY
+            )
+        except PermissionError:
+            # Priorities above 6 require CAP_NET_ADMIN
+            not_permitted = f" ({Settings.SOCKET_PRIORITY} not permitted)"
+    priority = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PRIORITY)
+    applied.append(f"SO_PRIORITY: {priority}{not_permitted}")
+
+    not_permitted = ""
+    try:
+        if Settings.SOCKET_BUSY_POLL is not None:
+            try:
+                sock.setsockopt(
+                    socket.SOL_SOCKET, SO_BUSY_POLL, Settings.SOCKET_BUSY_POLL
+                )
+            except PermissionError:
+                # Raising the busy poll time requires CAP_NET_ADMIN
+                not_permitted = f" ({Settings.SOCKET_BUSY_POLL} not permitted)"
+        busy_poll = sock.getsockopt(socket.SOL_SOCKET, SO_BUSY_POLL)
+        applied.append(f"SO_BUSY_POLL: {busy_poll}{not_permitted}")
+    except OSError as e:
+        # Kernels built without CONFIG_NET_RX_BUSY_POLL don't know the option
+        if e.errno != errno.ENOPROTOOPT:
+            raise
+        applied.append("SO_BUSY_POLL: unsupported")
+
+    not_permitted = ""
+    try:
+        if Settings.SOCKET_QDISC_BYPASS:
+            try:
+                sock.setsockopt(SOL_PACKET, PACKET_QDISC_BYPASS, 1)
+            except PermissionError:
+                not_permitted = " (not permitted)"
+        qdisc_bypass = sock.getsockopt(SOL_PACKET, PACKET_QDISC_BYPASS)
+        applied.append(
+            f"PACKET_QDISC_BYPASS: {bool(qdisc_bypass)}{not_permitted}"
+        )
+    except OSError as e:
+        # Kernels older than 3.14 don't know the option
+        if e.errno != errno.ENOPROTOOPT:
+            raise
+        applied.append("PACKET_QDISC_BYPASS: unsupported")
+
+    return [f"{intf} {setting}" for setting in applied]
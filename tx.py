@@ -2,14 +2,18 @@ from __future__ import annotations
 
 import signal
 from datetime import datetime
+from itertools import cycle
 from threading import Thread
 from time import sleep
 
 from scapy.config import conf  # type: ignore
 
-from packet import build_packet, rotate_values
+from packet import build_packet
+from plan import TxPlan
+from replay import load_replay
+from schedule import schedule_rotation_length
 from settings import Settings
-from stats import IntfStats
+from tuning import tune_socket, tune_thread
 
 
 class Tx:
@@ -26,12 +30,31 @@ class Tx:
         """
         Setup up and run the test threads
         """
-        build_packet()
+        for stream in Settings.STREAMS:
+            if stream.REPLAY:
+                load_replay(stream)
+            else:
+                build_packet(stream)
+
+        if Settings.CYCLES:
+            # The length of a cycle of a replay stream depends on the capture
+            Settings.MAX_PACKETS = Settings.CYCLES * schedule_rotation_length(
+                Settings.STREAMS
+            )
+
+        plan = TxPlan(Settings.STREAMS, len(Settings.INTERFACES))
+        Settings.STATS = plan.stats
 
-        print(
-            f"Going to transmit for {Settings.MAX_DURATION} seconds using interface(s) "
-            f"{Settings.INTERFACES}\n"
-        )
+        if Settings.MAX_PACKETS:
+            print(
+                f"Going to transmit {Settings.MAX_PACKETS} packets using interface(s) "
+                f"{Settings.INTERFACES}\n"
+            )
+        else:
+            print(
+                f"Going to transmit for {Settings.MAX_DURATION} seconds using interface(s) "
+                f"{Settings.INTERFACES}\n"
+            )
 
         if Settings.RUNNING_STATS:
             # The live stats thread eats up precious CPU cycles, hence optional
@@ -40,35 +63,53 @@ class Tx:
 
         signal.signal(signal.SIGINT, Tx.end)
 
-        tx_thd = Thread(target=Tx.tx)
+        tx_thd = Thread(target=Tx.tx, args=(plan,))
         tx_thd.start()
 
-        ctrl_thd = Thread(target=Tx.control)
+        ctrl_thd = Thread(target=Tx.control, args=(tx_thd,))
         sleep(0.5)  # Ensure other threads are ready
         print(f"Starting at {datetime.now()}")
         ctrl_thd.start()
 
         ctrl_thd.join()
         tx_thd.join()
+        # The stats thread may still be sleeping
+        finished = datetime.now()
         if Settings.RUNNING_STATS:
             stats_thd.join()
-        print(f"Finished at {datetime.now()}")
+        print(f"Finished at {finished}")
 
         # Print total across all interfaces
-        total_tx_pks = 0
-        for intf in Settings.INTERFACES:
-            total_tx_pks += Settings.STATS.intfs[intf].tx_pks
+        total_tx_pks = sum(Settings.STATS.intf_tx_pks)
         print(f"Sent {total_tx_pks} packets")
 
+        if len(Settings.STREAMS) > 1:
+            for slot, stream in enumerate(Settings.STREAMS):
+                print(
+                    f"Stream {stream.ID} sent "
+                    f"{Settings.STATS.stream_tx_pks[slot]} packets"
+                )
+
     @staticmethod
-    def control() -> None:
+    def control(tx_thd: Thread) -> None:
         """
         Start the test and loop until the $stop condition is true
         """
 
         Settings.TRANSMITTING = True
-        while Settings.DURATION < Settings.MAX_DURATION:
-            sleep(Settings.STATS_INTERVAL)
+        Settings.STARTED = True
+        # Also stop if the tx thread failed, e.g. when opening the sockets
+        while (
+            Settings.TRANSMITTING
+            and tx_thd.is_alive()
+            and (
+                # The tx thread stops itself once it has sent MAX_PACKETS
+                Settings.MAX_PACKETS
+                or Settings.DURATION < Settings.MAX_DURATION
+            )
+        ):
+            # Returns as soon as the tx thread has stopped
+            tx_thd.join(timeout=Settings.STATS_INTERVAL)
             Settings.DURATION += Settings.STATS_INTERVAL
 
         Settings.TRANSMITTING = False
@@ -79,8 +120,8 @@ class Tx:
         Periodically prints the test statistics
         """
 
-        # Wait for start signal
-        while not Settings.TRANSMITTING:
+        # Wait for start signal, a short test might already have finished
+        while not Settings.STARTED:
             ...
 
         print("")
@@ -102,14 +143,15 @@ class Tx:
 
             total_diff = 0
             total_tx_pks = 0
-            for intf in Settings.INTERFACES:
-                intf_stats = Settings.STATS.intfs[intf]
-                diff = intf_stats.tx_pks - intf_stats.tx_pks_last
-                intf_stats.tx_pks_last = intf_stats.tx_pks
+            stats = Settings.STATS
+            for idx, intf in enumerate(Settings.INTERFACES):
+                tx_pks = stats.intf_tx_pks[idx]
+                diff = tx_pks - stats.intf_tx_pks_last[idx]
+                stats.intf_tx_pks_last[idx] = tx_pks
                 total_diff += diff
-                total_tx_pks += intf_stats.tx_pks
+                total_tx_pks += tx_pks
                 print(
-                    f"| {Settings.DURATION:^4} | {intf:^9} | {diff:^7} | {intf_stats.tx_pks:^10} |"
+                    f"| {Settings.DURATION:^4} | {intf:^9} | {diff:^7} | {tx_pks:^10} |"
                 )
             print(
                 f"| {Settings.DURATION:^4} |     *     | {total_diff:^7} | {total_tx_pks:^10} |"
@@ -118,7 +160,7 @@ class Tx:
         print("")
 
     @staticmethod
-    def tx() -> None:
+    def tx(plan: TxPlan) -> None:
         """
         Start a loop which transmits packets
         """
@@ -128,26 +170,67 @@ class Tx:
         sending the frame, then closing the socket a again. It is SUPER slow.
         Create a socket which stays open for each interface:
         """
-        sockets = {}
-        for intf in Settings.INTERFACES:
-            sockets[intf] = conf.L2socket(iface=intf)
+        applied = tune_thread()
+        sockets = []
+        for name in Settings.INTERFACES:
+            sockets.append(conf.L2socket(iface=name))
+            applied += tune_socket(name, sockets[-1].outs)
+
+        # Report the applied settings so that results are reproducible
+        print("Tx tuning:")
+        for setting in applied:
+            print(f"  {setting}")
+        print("")
 
-            # Create a stats objects per-intf which will be updated during the test
-            Settings.STATS.intfs[intf] = IntfStats()
+        """
+        Bind everything the loop uses to local names, so that the loop only
+        does local variable lookups and list/array indexing per packet.
+        The frames are sent with the send() of the underlying socket of the
+        scapy sockets, because the scapy send() converts and timestamps
+        every frame.
+        """
+        sends = [sock.outs.send for sock in sockets]
+        frames = plan.frames
+        mutators = plan.mutators
+        schedule = cycle(plan.schedule)
+        intf_tx_pks = plan.stats.intf_tx_pks
+        stream_tx_pks = plan.stats.stream_tx_pks
+        gap = Settings.INTER_PACKET_GAP
+        remaining = Settings.MAX_PACKETS
+        intfs = range(0, len(sockets))
 
         # Wait for start signal
         while not Settings.TRANSMITTING:
             ...
 
         while Settings.TRANSMITTING:
-            for intf in Settings.INTERFACES:
-                # send(x=Settings.PACKET, iface=intf, verbose=0)  # 30pps !!!
-                # sendp(x=Settings.PACKET, iface=intf, verbose=0)  # 24 pps !!!
-                # sendpfast(x=Settings.PACKET, iface=intf, pps=10000)  # 15 pps !!!
-                sockets[intf].send(x=Settings.PACKET)  # 6k pps :D
-                Settings.STATS.intfs[intf].tx_pks += 1
-                if Settings.ROTATE:
-                    rotate_values()
+            if remaining:
+                """
+                The check is done per round across all interfaces instead
+                of per packet, to keep the pps rate up. The last round is
+                shortened so that exactly MAX_PACKETS are sent.
+                """
+                if remaining <= len(intfs):
+                    intfs = intfs[:remaining]
+                    Settings.TRANSMITTING = False
+                remaining -= len(intfs)
+
+            for intf in intfs:
+                slot = next(schedule)
+                frame = frames[slot]
+                # send(x=frame, iface=intf, verbose=0)  # 30pps !!!
+                # sendp(x=frame, iface=intf, verbose=0)  # 24 pps !!!
+                # sendpfast(x=frame, iface=intf, pps=10000)  # 15 pps !!!
+                try:
+                    sends[intf](frame)
+                except OSError:
+                    # Let scapy pad a frame which the driver finds too short
+                    sockets[intf].send(frame)
+                intf_tx_pks[intf] += 1
+                n = stream_tx_pks[slot] + 1
+                stream_tx_pks[slot] = n
+                for mutate in mutators[slot]:
+                    mutate(frame, n)
             """
             This defaults to 0.0.
             This hack is needed to ensure this thread yields to the other
@@ -155,7 +238,7 @@ class Tx:
             don't run properly (e.g. the control thread can't count the duration
             properly and the test runs for much longer that it should).
             """
-            sleep(Settings.INTER_PACKET_GAP)
+            sleep(gap)
 
-        for intf in Settings.INTERFACES:
-            sockets[intf].close()
+        for sock in sockets:
+            sock.close()